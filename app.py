@@ -1,45 +1,86 @@
 import os
-import json
-import subprocess
 import threading
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, send_from_directory
 import asyncio
+import orjson
+from flask_compress import Compress
 from flask_cors import CORS
-from dotenv import load_dotenv
 
-# Import MCP client functionality
-from backend.mcp_client import process_message, get_all_patients, get_patient_details, create_patient
+# Import MCP client functionality (loads .env and reads the API key once)
+from backend.mcp_client import (
+    process_message, stream_message, read_patients_json, read_patient_details_json,
+    create_patient, create_patient_reports, get_patient_reports
+)
+
+# Create Flask app; the React build is served by serve() below rather than
+# Flask's static route, so unknown paths fall back to index.html
+app = Flask(__name__, static_folder=None)
+STATIC_FOLDER = os.path.join(app.root_path, 'dist')
 
-# Load environment variables
-load_dotenv()
+# Vite emits content-hashed file names under assets/, so they never go stale
+ASSET_MAX_AGE = 31536000
 
-# Create Flask app
-app = Flask(__name__, 
-    static_folder='dist',
-    static_url_path=''
+# The build output is immutable while the app runs, so index it once
+STATIC_FILES = frozenset(
+    os.path.relpath(os.path.join(root, name), STATIC_FOLDER).replace(os.sep, '/')
+    for root, _, names in os.walk(STATIC_FOLDER)
+    for name in names
 )
 
 # Enable CORS
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# MCP server process
-mcp_server_process = None
-
-def start_mcp_server():
-    """Start the MCP server as a subprocess."""
-    global mcp_server_process
-    # Start the server if not already running
-    if mcp_server_process is None or mcp_server_process.poll() is not None:
-        print("Starting MCP server...")
-        mcp_server_process = subprocess.Popen(
-            ["python", "backend/server.py"],  # Update path to your server.py
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        print("MCP server started")
-
-# Start MCP server when Flask app starts
-start_mcp_server()
+# Compress JSON and static responses; text/event-stream is left uncompressed
+# so streamed chat tokens are flushed immediately. flask-compress's defaults
+# miss text/javascript, the type .js files are served as, and SVG icons
+app.config['COMPRESS_MIMETYPES'] = [
+    'text/html', 'text/css', 'text/xml', 'application/json',
+    'application/javascript', 'text/javascript', 'image/svg+xml'
+]
+Compress(app)
+
+def json_response(payload, status=200):
+    """Serialize a payload with orjson into a JSON response."""
+    return app.response_class(
+        orjson.dumps(payload),
+        status=status,
+        mimetype='application/json'
+    )
+
+def raw_json_response(body, status=200):
+    """Send JSON text that is already serialized without re-encoding it."""
+    return app.response_class(body, status=status, mimetype='application/json')
+
+# Persistent event loop for MCP client coroutines, shared by all requests;
+# uvloop's faster loop is used for the stdio and HTTP traffic when installed
+try:
+    import uvloop
+except ImportError:
+    event_loop = asyncio.new_event_loop()
+else:
+    event_loop = uvloop.new_event_loop()
+threading.Thread(target=event_loop.run_forever, daemon=True).start()
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, event_loop).result()
+
+def iterate_async(agen):
+    """Iterate an async generator on the shared event loop from sync code."""
+    async def next_item():
+        try:
+            return await agen.__anext__()
+        except StopAsyncIteration:
+            return None
+    
+    try:
+        while True:
+            item = run_async(next_item())
+            if item is None:
+                return
+            yield item
+    finally:
+        run_async(agen.aclose())
 
 # API Routes
 @app.route('/chat', methods=['POST'])
@@ -49,65 +90,76 @@ def chat():
     data = request.json
     message = data.get('message', '')
     
-    # Create a new event loop for async operation
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
     try:
         # Call existing MCP client function
-        result = loop.run_until_complete(process_message(message))
-        return jsonify(result)
+        result = run_async(process_message(message))
+        return json_response(result)
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
-        return jsonify({"error": str(e)}), 500
-    finally:
-        loop.close()
+        return json_response({"error": str(e)}, 500)
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream chat responses through MCP as server-sent events."""
+    data = request.json
+    message = data.get('message', '')
+    
+    def generate():
+        try:
+            for event in iterate_async(stream_message(message)):
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {str(e)}")
+            yield b"data: " + orjson.dumps({"type": "error", "content": str(e)}) + b"\n\n"
+    
+    return app.response_class(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/patients', methods=['GET'])
 def get_patients():
     """Get all patients data."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    try:
-        patients_data = loop.run_until_complete(get_all_patients())
-        return jsonify(patients_data)
-    finally:
-        loop.close()
+    # The MCP server already serializes the patient list, so pass it through
+    return raw_json_response(run_async(read_patients_json()))
 
 @app.route('/patients/<patient_id>', methods=['GET'])
 def get_patient(patient_id):
     """Get details for a specific patient."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    try:
-        patient_data = loop.run_until_complete(get_patient_details(patient_id))
-        return jsonify(patient_data)
-    finally:
-        loop.close()
+    patient_data = run_async(read_patient_details_json(patient_id))
+    if patient_data == "null":
+        return json_response({"error": f"Patient with ID {patient_id} not found."}, 404)
+    return raw_json_response(patient_data)
 
 @app.route('/patients', methods=['POST'])
 def create_new_patient():
     """Create a new patient."""
     data = request.json
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    try:
-        result = loop.run_until_complete(create_patient(data))
-        return jsonify({"message": result})
-    finally:
-        loop.close()
+    result = run_async(create_patient(data))
+    return json_response({"message": result})
+
+@app.route('/reports', methods=['POST'])
+def create_reports():
+    """Start generating summary reports for all patients as a batch."""
+    batch = run_async(create_patient_reports())
+    return json_response(batch, 202)
+
+@app.route('/reports/<batch_id>', methods=['GET'])
+def get_reports(batch_id):
+    """Get the status of a report batch, with the reports once finished."""
+    reports = run_async(get_patient_reports(batch_id))
+    return json_response(reports)
 
 # Serve React app
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    if path != "" and os.path.exists(app.static_folder + '/' + path):
-        return send_from_directory(app.static_folder, path)
+    if path in STATIC_FILES:
+        max_age = ASSET_MAX_AGE if path.startswith('assets/') else None
+        return send_from_directory(STATIC_FOLDER, path, max_age=max_age)
     else:
-        return send_from_directory(app.static_folder, 'index.html')
+        return send_from_directory(STATIC_FOLDER, 'index.html', max_age=0)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    app.run(debug=True, port=5000, threaded=True)
@@ -0,0 +1,47 @@
+import time
+from collections import OrderedDict
+
+
+def normalize_query(text: str) -> str:
+    """Normalize case and whitespace so trivially different queries share a key."""
+    return " ".join(text.lower().split())
+
+
+class ResponseCache:
+    """Bounded LRU cache of Claude responses keyed by exact query text."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = None):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of responses kept before evicting the oldest
+            ttl: Seconds a response stays valid, or None to keep it until evicted
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss or once expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and time.monotonic() >= expires:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Store a response, evicting the least recently used entry if full."""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached response, e.g. after patient data changes."""
+        self._entries.clear()
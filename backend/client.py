@@ -1,22 +1,107 @@
 import asyncio
-import json
+import hashlib
 import ssl
 import os
+import re
+from pathlib import Path
 from typing import List, Dict, Any, Optional
-from dotenv import load_dotenv
 
-import anthropic
-import httpx
-import urllib3
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+import orjson
 
-# Load environment variables from .env file
-load_dotenv()
+from cache import ResponseCache
+
+# Load environment variables from .env file unless the key is already set;
+# the API and MCP client libraries are imported lazily when a client is built
+if os.environ.get("ANTHROPIC_API_KEY") is None:
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Get API key from environment
 API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 
+# Sonnet handles the session; short, simple turns go to the faster Haiku
+MODEL = "claude-3-5-sonnet-20240620"
+FAST_MODEL = "claude-3-haiku-20240307"
+FAST_MODEL_MAX_CHARS = 120
+COMPLEX_REQUEST_WORDS = ("why", "analyze", "compare", "explain", "summarize")
+
+# Follow-up rounds of tool calls allowed per message before giving up
+MAX_TOOL_ROUNDS = 5
+
+# System prompt (must be passed separately, not as a message)
+SYSTEM_PROMPT = "You are a veterinary assistant AI helping with a Veterinary Practice Management System. You have access to patient data and can perform operations like creating and updating patient records, adding appointments, and recording weight and vaccination information. Provide succinct answers to the information requested by the user."
+
+# Tool schemas from the last session, reused until the server script changes
+TOOLS_CACHE_PATH = Path("~/.cache/vetmcp/tools.json").expanduser()
+
+# Once the history grows past this many characters, older turns are summarized
+# until it is back under the target; compaction waits until there is enough new
+# material, so a long recent tail doesn't rewrite the summary every turn
+HISTORY_CHAR_LIMIT = 6000
+HISTORY_COMPACT_TARGET = HISTORY_CHAR_LIMIT // 2
+HISTORY_MIN_SUMMARIZE = HISTORY_CHAR_LIMIT // 4
+HISTORY_KEEP_RECENT = 6
+SUMMARY_MODEL = FAST_MODEL
+SUMMARY_PREFIX = "Summary of our conversation so far:\n"
+
+# Requests simple enough to answer straight from the MCP server, without Claude;
+# searches must be for a single bare term, anything longer is a question
+LIST_PATIENTS_RE = re.compile(r"\s*list (all )?patients\s*", re.IGNORECASE)
+SHOW_PATIENT_RE = re.compile(r"\s*show\s+(P\d+)\s*", re.IGNORECASE)
+SEARCH_PATIENTS_RE = re.compile(r"\s*search\s+(?:for\s+)?(\S+)\s*", re.IGNORECASE)
+
+# Prompt cache breakpoint; everything up to a marked block is reused across turns
+CACHE_CONTROL = {"type": "ephemeral"}
+
+def with_history_breakpoint(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Return the history with a cache breakpoint on its last content block.
+    
+    The stored history is left unmarked so the breakpoint moves forward each
+    turn instead of piling up on older messages.
+    
+    Args:
+        messages: Conversation history, ending with the newest user turn
+    """
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = list(content)
+    blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+    return messages[:-1] + [{**last, "content": blocks}]
+
+def pick_model(user_input: str, tool_uses: int = 0) -> str:
+    """
+    Choose the model for a turn from a cheap look at the user's request.
+    
+    Args:
+        user_input: The user's message
+        tool_uses: Number of tool calls whose results the reply must combine
+    """
+    text = user_input.lower()
+    if (
+        len(user_input) < FAST_MODEL_MAX_CHARS
+        and tool_uses <= 1
+        and not any(word in text for word in COMPLEX_REQUEST_WORDS)
+    ):
+        return FAST_MODEL
+    return MODEL
+
+def response_cache_key(system_prompt: str, tools_sig: str, messages: List[Dict[str, Any]], user_input: str) -> str:
+    """
+    Hash everything that determines Claude's reply to a new user message.
+    
+    Args:
+        system_prompt: System prompt for the session
+        tools_sig: Signature of the tool definitions offered to Claude
+        messages: Conversation history before the new message
+        user_input: The new user message
+    """
+    payload = [system_prompt, tools_sig, messages[-4:], user_input]
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
 class VetClaudeClient:
     """Client for interacting with Claude and the Vet Clinic MCP server."""
     
@@ -31,19 +116,26 @@ class VetClaudeClient:
         if not API_KEY:
             raise ValueError("Please set ANTHROPIC_API_KEY environment variable")
         
-        # Create a custom httpx client with SSL verification disabled for development
-        http_client = httpx.Client(
-            verify=False,  # Disable SSL verification for development
-            timeout=90.0   # Increased timeout
-        )
+        import anthropic
+        import httpx
+        from mcp import StdioServerParameters
         
-        # Suppress SSL warnings (since we're disabling verification)
-        import urllib3
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        # Create one long-lived httpx client so every turn reuses a pooled
+        # HTTP/2 connection. Certificates are verified against certifi's CA
+        # bundle, or the one named by SSL_CERT_FILE behind a TLS-intercepting proxy
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(90.0, connect=5.0),  # Increased timeout
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=60.0
+            )
+        )
         
-        self.claude = anthropic.Anthropic(
+        self.claude = anthropic.AsyncAnthropic(
             api_key=API_KEY,
-            http_client=http_client
+            http_client=self.http_client
         )
         
         # Initialize MCP server parameters
@@ -53,166 +145,339 @@ class VetClaudeClient:
             args=[server_path],
             env=None
         )
+        
+        # Replies to repeated questions, keyed by response_cache_key
+        self.response_cache = ResponseCache(maxsize=1024)
+        
+        # Request parameters that stay the same for every call; the static
+        # system prompt is cached as a prefix shared by every call
+        self._system = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
+        self._tools = []
+        self._tools_sig = ""
+    
+    async def stream_reply(self, **params):
+        """
+        Stream a Claude response, printing text as it arrives.
+        
+        Args:
+            **params: Arguments for messages.stream
+            
+        Returns:
+            The complete final message, for tool dispatch and history
+        """
+        async with self.claude.messages.stream(**params) as stream:
+            started = False
+            async for text in stream.text_stream:
+                if not started:
+                    print("\nClaude: ", end="", flush=True)
+                    started = True
+                print(text, end="", flush=True)
+            if started:
+                print()
+            return await stream.get_final_message()
+    
+    async def load_tools(self, session) -> List[Dict[str, Any]]:
+        """
+        Get the server's tool definitions, from the disk cache when it is current.
+        
+        Args:
+            session: Initialized MCP client session
+        """
+        server_mtime = os.stat(self.server_path).st_mtime
+        try:
+            cached = orjson.loads(TOOLS_CACHE_PATH.read_bytes())
+            if cached["server_path"] == os.path.abspath(self.server_path) and cached["server_mtime"] == server_mtime:
+                return cached["tools"]
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        tools_result = await session.list_tools()
+        tools = [
+            {"name": tool.name, "description": tool.description, "input_schema": tool.inputSchema}
+            for tool in tools_result.tools
+        ]
+        
+        try:
+            TOOLS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            TOOLS_CACHE_PATH.write_bytes(orjson.dumps({
+                "server_path": os.path.abspath(self.server_path),
+                "server_mtime": server_mtime,
+                "tools": tools
+            }))
+        except OSError:
+            pass  # The cache is only an optimization
+        
+        return tools
+    
+    async def compact_history(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Replace older turns with a short summary once the history gets long.
+        
+        The opening message and the most recent turns are kept verbatim. The cut
+        is made at a plain user message so tool_use/tool_result pairs stay together,
+        as early as still brings the history under HISTORY_COMPACT_TARGET.
+        
+        Args:
+            messages: Conversation history
+            
+        Returns:
+            The compacted history, or the original one if no compaction was needed
+        """
+        sizes = [len(orjson.dumps(message, default=str)) for message in messages]
+        if sum(sizes) <= HISTORY_CHAR_LIMIT:
+            return messages
+        
+        cuts = [
+            i for i in range(2, len(messages) - HISTORY_KEEP_RECENT + 1)
+            if messages[i]["role"] == "user" and isinstance(messages[i]["content"], str)
+        ]
+        if not cuts:
+            return messages
+        cut = next(
+            (i for i in cuts if sizes[0] + sum(sizes[i:]) <= HISTORY_COMPACT_TARGET),
+            cuts[-1]
+        )
+        
+        # Skip when little beyond the previous summary would be summarized
+        content = messages[1]["content"]
+        start = 2 if isinstance(content, str) and content.startswith(SUMMARY_PREFIX) else 1
+        if sum(sizes[start:cut]) < HISTORY_MIN_SUMMARIZE:
+            return messages
+        
+        try:
+            summary = await self.claude.messages.create(
+                model=SUMMARY_MODEL,
+                messages=[{
+                    "role": "user",
+                    "content": "Summarize this conversation between a veterinarian and an assistant as brief bullet points. Preserve every patient ID, name, date and record change.\n\n"
+                    + orjson.dumps(messages[1:cut], default=str).decode()
+                }],
+                max_tokens=500
+            )
+        except Exception as e:
+            print(f"\nError summarizing conversation: {str(e)}")
+            return messages
+        
+        summary_text = "".join(content.text for content in summary.content if content.type == "text")
+        return [
+            messages[0],
+            {"role": "assistant", "content": SUMMARY_PREFIX + summary_text}
+        ] + messages[cut:]
+    
+    async def route_intent(self, session, user_input: str) -> Optional[str]:
+        """
+        Answer list/show/search requests directly from the MCP server.
+        
+        Searches with no matches fall through to Claude.
+        
+        Args:
+            session: Initialized MCP client session
+            user_input: The user's message
+            
+        Returns:
+            The answer text, or None if Claude should handle the message
+        """
+        try:
+            if LIST_PATIENTS_RE.fullmatch(user_input):
+                result = await session.read_resource("patients://all")
+                return result.contents[0].text
+            
+            match = SHOW_PATIENT_RE.fullmatch(user_input)
+            if match:
+                result = await session.read_resource(f"patients://{match.group(1).upper()}")
+                return result.contents[0].text
+            
+            match = SEARCH_PATIENTS_RE.fullmatch(user_input)
+            if match:
+                result = await session.call_tool("query_patients", {"search_term": match.group(1)})
+                text = next((item.text for item in result.content if item.type == "text"), None)
+                # Let Claude interpret searches the index can't answer
+                if text and not text.startswith("No patients found"):
+                    return text
+        except Exception as e:
+            print(f"\nError: {str(e)}")
+        
+        return None
+    
+    async def warm_up(self):
+        """Open the pooled connection to the Anthropic API ahead of the first real call."""
+        try:
+            await self.claude.with_options(timeout=5.0, max_retries=0).models.list(limit=1)
+        except Exception:
+            pass  # Best effort; the first real call will connect instead
     
     async def chat_session(self):
         """Start an interactive chat session with Claude using the MCP server."""
-        # Connect to the MCP server
-        async with stdio_client(self.server_params) as (read_stream, write_stream):
-            async with ClientSession(read_stream, write_stream) as session:
-                # Initialize session
-                await session.initialize()
-                print("Connected to Vet Clinic MCP server")
-                
-                # Get available tools
-                tools_result = await session.list_tools()
-                tools = []
-                for tool in tools_result.tools:
-                    tool_obj = {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "input_schema": tool.inputSchema
-                    }
-                    tools.append(tool_obj)
-                
-                print(f"Loaded {len(tools)} tools from the server")
-                
-                # Initialize conversation
-                messages = [
-                    {
-                        "role": "user", 
-                        "content": "I'm a veterinarian using a practice management system. I need your help to access and manage patient data."
-                    }
-                ]
-                
-                # System prompt (must be passed separately, not as a message)
-                system_prompt = "You are a veterinary assistant AI helping with a Veterinary Practice Management System. You have access to patient data and can perform operations like creating and updating patient records, adding appointments, and recording weight and vaccination information. Provide succinct answers to the information requested by the user."
-                
-                # First response from Claude
-                initial_response = self.claude.messages.create(
-                    model="claude-3-5-sonnet-20240620",
-                    system=system_prompt,  # System prompt as a separate parameter
-                    messages=messages,
-                    max_tokens=1000
-                )
-                
-                # Display Claude's initial response
-                initial_text = initial_response.content[0].text
-                print(f"\nClaude: {initial_text}")
-                
-                # Add Claude's response to the conversation
-                messages.append({"role": "assistant", "content": initial_text})
-                
-                # Chat loop
-                while True:
-                    # Get user input
-                    user_input = input("\nYou: ")
-                    if user_input.lower() in ["exit", "quit", "bye"]:
-                        print("Ending session.")
-                        break
+        from mcp import ClientSession
+        from mcp.client.stdio import stdio_client
+        
+        # Do DNS, TCP and TLS setup while the MCP server starts
+        warm_up = asyncio.create_task(self.warm_up())
+        
+        try:
+            # Connect to the MCP server
+            async with stdio_client(self.server_params) as (read_stream, write_stream):
+                async with ClientSession(read_stream, write_stream) as session:
+                    # Initialize session
+                    await session.initialize()
+                    print("Connected to Vet Clinic MCP server")
                     
-                    # Add user message to conversation
-                    messages.append({"role": "user", "content": user_input})
+                    # Initialize conversation
+                    messages = [
+                        {
+                            "role": "user", 
+                            "content": "I'm a veterinarian using a practice management system. I need your help to access and manage patient data."
+                        }
+                    ]
                     
-                    # Send to Claude
-                    response = self.claude.messages.create(
-                        model="claude-3-5-sonnet-20240620",  # Using a newer model
-                        system=system_prompt,  # System prompt as a separate parameter
-                        messages=messages,
-                        tools=tools,
-                        max_tokens=1000
+                    # First response from Claude needs no tools, so load them meanwhile
+                    await warm_up
+                    tools, initial_response = await asyncio.gather(
+                        self.load_tools(session),
+                        self.stream_reply(
+                            model=MODEL,
+                            system=self._system,  # System prompt as a separate parameter
+                            messages=with_history_breakpoint(messages),
+                            max_tokens=1000
+                        )
                     )
                     
-                    # Process Claude's response
-                    for content in response.content:
-                        if content.type == "text":
-                            # Display Claude's text response
-                            print(f"\nClaude: {content.text}")
-                            messages.append({"role": "assistant", "content": content.text})
+                    print(f"Loaded {len(tools)} tools from the server")
+                    
+                    # Mark the end of the tool list so the tool schemas are cached,
+                    # and fix the list for the rest of the session
+                    if tools:
+                        tools[-1] = {**tools[-1], "cache_control": CACHE_CONTROL}
+                    self._tools = tools
+                    self._tools_sig = hashlib.sha256(orjson.dumps(tools)).hexdigest()
+                    
+                    initial_text = initial_response.content[0].text
+                    
+                    # Add Claude's response to the conversation
+                    messages.append({"role": "assistant", "content": initial_text})
+                    
+                    # Chat loop
+                    while True:
+                        # Compact the history while waiting for the user to type
+                        compaction = asyncio.create_task(self.compact_history(messages))
                         
-                        elif content.type == "tool_use":
-                            # Claude wants to use a tool
-                            tool_name = content.name
-                            tool_args = content.input
+                        # Get user input without blocking the event loop
+                        user_input = await asyncio.to_thread(input, "\nYou: ")
+                        messages = await compaction
+                        if user_input.lower() in ["exit", "quit", "bye"]:
+                            print("Ending session.")
+                            break
+                        
+                        # Answer simple lookups directly; the exchange is kept in the history
+                        routed_reply = await self.route_intent(session, user_input)
+                        if routed_reply is not None:
+                            print(f"\n{routed_reply}")
+                            messages.append({"role": "user", "content": user_input})
+                            messages.append({"role": "assistant", "content": routed_reply})
+                            continue
+                        
+                        # Answer exact repeats of an earlier turn without calling Claude
+                        cache_key = response_cache_key(SYSTEM_PROMPT, self._tools_sig, messages, user_input)
+                        cached_reply = self.response_cache.get(cache_key)
+                        
+                        # Add user message to conversation
+                        messages.append({"role": "user", "content": user_input})
+                        
+                        if cached_reply is not None:
+                            print(f"\nClaude: {cached_reply}")
+                            messages.append({"role": "assistant", "content": cached_reply})
+                            continue
+                        
+                        # Send to Claude
+                        response = await self.stream_reply(
+                            model=pick_model(user_input),
+                            system=self._system,  # System prompt as a separate parameter
+                            messages=with_history_breakpoint(messages),
+                            tools=self._tools,
+                            max_tokens=1000
+                        )
+                        
+                        # Run the requested tools until Claude answers without asking
+                        # for more; the text was printed while streaming
+                        tool_rounds = 0
+                        while True:
+                            tool_uses = [content for content in response.content if content.type == "tool_use"]
+                            if not tool_uses:
+                                break
+                            if tool_rounds == MAX_TOOL_ROUNDS:
+                                print(f"\nError: Stopped after {MAX_TOOL_ROUNDS} rounds of tool calls without a final answer.")
+                                break
+                            tool_rounds += 1
+                            
+                            for content in tool_uses:
+                                print(f"\nClaude is using tool: {content.name}")
+                                print(f"With arguments: {orjson.dumps(content.input, option=orjson.OPT_INDENT_2).decode()}")
                             
-                            print(f"\nClaude is using tool: {tool_name}")
-                            print(f"With arguments: {json.dumps(tool_args, indent=2)}")
+                            # Execute all requested tools concurrently
+                            tool_outputs = await asyncio.gather(
+                                *[session.call_tool(content.name, content.input) for content in tool_uses],
+                                return_exceptions=True
+                            )
                             
-                            # Execute the tool
-                            try:
-                                result = await session.call_tool(tool_name, tool_args)
-                                tool_result = "Tool execution failed."
+                            tool_results = []
+                            for content, result in zip(tool_uses, tool_outputs):
+                                if isinstance(result, Exception):
+                                    error_message = f"Error executing tool: {str(result)}"
+                                    print(f"\nError: {error_message}")
+                                    
+                                    # Inform Claude about the error
+                                    tool_results.append({
+                                        "type": "tool_result",
+                                        "tool_use_id": content.id,
+                                        "content": f"Error: {error_message}",
+                                        "is_error": True
+                                    })
+                                    continue
                                 
                                 # Extract the text result
-                                for item in result.content:
-                                    if hasattr(item, 'text'):
-                                        tool_result = item.text
+                                tool_result = next((item.text for item in result.content if item.type == "text"), "Tool execution failed.")
                                 
                                 # Show tool result
                                 print(f"\nTool result: {tool_result}")
                                 
-                                # Add tool use to conversation history properly
-                                # First the assistant's tool use
-                                messages.append({
-                                    "role": "assistant",
-                                    "content": [
-                                        {
-                                            "type": "tool_use", 
-                                            "id": content.id, 
-                                            "name": tool_name, 
-                                            "input": tool_args
-                                        }
-                                    ]
+                                tool_results.append({
+                                    "type": "tool_result",
+                                    "tool_use_id": content.id,
+                                    "content": tool_result
                                 })
-                                
-                                # Then the tool result from user
-                                messages.append({
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "tool_result", 
-                                            "tool_use_id": content.id, 
-                                            "content": tool_result
-                                        }
-                                    ]
-                                })
-                                
-                                # Get Claude's response after tool use
-                                tool_response = self.claude.messages.create(
-                                    model="claude-3-5-sonnet-20240620", 
-                                    system=system_prompt,  # System prompt as a separate parameter
-                                    messages=messages,
-                                    max_tokens=1000
-                                )
-                                
-                                # Extract and display Claude's response to the tool result
-                                for tool_content in tool_response.content:
-                                    if tool_content.type == "text":
-                                        print(f"\nClaude: {tool_content.text}")
-                                        messages.append({"role": "assistant", "content": tool_content.text})
-                                        
-                            except Exception as e:
-                                error_message = f"Error executing tool: {str(e)}"
-                                print(f"\nError: {error_message}")
-                                
-                                # Inform Claude about the error
-                                messages.append({
-                                    "role": "assistant", 
-                                    "content": [
-                                        {"type": "tool_use", "id": content.id, "name": tool_name, "input": tool_args}
-                                    ]
-                                })
-                                messages.append({
-                                    "role": "user", 
-                                    "content": [
-                                        {
-                                            "type": "tool_result", 
-                                            "tool_use_id": content.id, 
-                                            "content": f"Error: {error_message}"
-                                        }
-                                    ]
-                                })
-                
-                print("\nDisconnected from Vet Clinic MCP server")
+                            
+                            # Add the assistant's tool uses and all their results to the history
+                            messages.append({
+                                "role": "assistant",
+                                "content": [content.model_dump(exclude_none=True) for content in response.content]
+                            })
+                            messages.append({"role": "user", "content": tool_results})
+                            
+                            # Get Claude's response to all tool results in a single call,
+                            # still offering the tools so it can chain further calls
+                            response = await self.stream_reply(
+                                model=pick_model(user_input, len(tool_uses)),
+                                system=self._system,  # System prompt as a separate parameter
+                                messages=with_history_breakpoint(messages),
+                                tools=self._tools,
+                                max_tokens=1000
+                            )
+                        
+                        # Add Claude's final response to the conversation
+                        for content in response.content:
+                            if content.type == "text":
+                                messages.append({"role": "assistant", "content": content.text})
+                        
+                        # Only plain answers are cached; tool turns depend on live data
+                        if not tool_rounds:
+                            self.response_cache.put(cache_key, "".join(
+                                content.text for content in response.content if content.type == "text"
+                            ))
+                    
+                    print("\nDisconnected from Vet Clinic MCP server")
+        finally:
+            # Release pooled connections to the Anthropic API
+            await self.http_client.aclose()
 
 
 async def main():
@@ -227,4 +492,10 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Prefer uvloop's faster event loop for the stdio and HTTP traffic when installed
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -2,11 +2,87 @@ import sqlite3
 import os
 import json
 
+# Indexes matching how patient data is read: detail lists by patient, newest
+# first, and patient lists ordered by name
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_appt_patient ON appointments (patient_id, date DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_weight_patient ON weight_records (patient_id, date DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_vacc_patient_date ON vaccinations (patient_id, date DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_patient_species ON patients (species)',
+    'CREATE INDEX IF NOT EXISTS idx_patient_name ON patients (name)',
+]
+
+# Indexes from earlier versions that no longer match any query
+OBSOLETE_INDEXES = ['idx_vacc_patient']
+
+def create_indexes(cursor):
+    """Bring the indexes up to date and refresh the query planner's statistics."""
+    for statement in INDEXES:
+        cursor.execute(statement)
+    for name in OBSOLETE_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    cursor.execute('ANALYZE')
+
+def create_search_index(cursor):
+    """
+    Create the full-text index for patient search if it is missing.
+    
+    The trigram tokenizer supports case-insensitive substring matches, and
+    triggers keep the index in sync with the patients table. A newly created
+    index is filled from the patients already in the database.
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='patients_fts'"
+    ).fetchone()
+    if exists:
+        return
+    
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE patients_fts USING fts5(
+            name, species, breed,
+            content='patients', content_rowid='rowid', tokenize='trigram'
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5 (or older than 3.34); search falls back to LIKE
+        print(f"Full-text search unavailable: {e}")
+        return
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN
+        INSERT INTO patients_fts (rowid, name, species, breed)
+        VALUES (new.rowid, new.name, new.species, new.breed);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, name, species, breed)
+        VALUES ('delete', old.rowid, old.name, old.species, old.breed);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS patients_fts_update AFTER UPDATE ON patients BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, name, species, breed)
+        VALUES ('delete', old.rowid, old.name, old.species, old.breed);
+        INSERT INTO patients_fts (rowid, name, species, breed)
+        VALUES (new.rowid, new.name, new.species, new.breed);
+    END
+    ''')
+    cursor.execute("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')")
+
 def init_db(db_path="vet_clinic.db"):
     """Initialize the veterinary clinic database with the schema."""
-    # Check if db already exists - don't reinitialize if it does
+    # Check if db already exists - don't reinitialize if it does, but apply
+    # index changes so existing databases get them too
     if os.path.exists(db_path):
         print(f"Database {db_path} already exists. Skipping initialization.")
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        create_search_index(cursor)
+        create_indexes(cursor)
+        conn.commit()
+        conn.close()
         return
     
     print(f"Initializing database {db_path}...")
@@ -15,6 +91,12 @@ def init_db(db_path="vet_clinic.db"):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # Create the schema and sample data in a single transaction; a new file has
+    # nothing to protect, so seeding skips the on-disk journal and fsyncs
+    cursor.execute("PRAGMA journal_mode=MEMORY")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("BEGIN")
+    
     # Create tables
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS patients (
@@ -107,6 +189,10 @@ def init_db(db_path="vet_clinic.db"):
     VALUES (?, ?, ?, ?)
     ''', sample_vaccinations)
     
+    # Index the loaded data in one pass
+    create_search_index(cursor)
+    create_indexes(cursor)
+    
     # Commit changes and close connection
     conn.commit()
     conn.close()
@@ -1,13 +1,21 @@
 import asyncio
+import base64
 import os
 import json
+import re
+from contextlib import AsyncExitStack
 from typing import Dict, Any, List
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 # Import or initialize your anthropic client for Claude
 import anthropic
+import anyio
+import httpx
+import orjson
 from dotenv import load_dotenv
 
+from backend.cache import ResponseCache, normalize_query
+
 # Load environment variables
 load_dotenv()
 
@@ -16,7 +24,35 @@ API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 if not API_KEY:
     raise ValueError("ANTHROPIC_API_KEY not set in environment")
 
-claude = anthropic.Anthropic(api_key=API_KEY)
+# Shared HTTP/2 connection pool, so chat turns reuse warm TLS connections
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=10.0),
+    timeout=httpx.Timeout(60.0)
+)
+
+claude = anthropic.AsyncAnthropic(api_key=API_KEY, http_client=http_client)
+
+# Model and system prompt are constant for the process lifetime
+MODEL = "claude-3-5-sonnet-20240620"
+SYSTEM_PROMPT = "You are a veterinary assistant AI helping with a Veterinary Practice Management System. Provide concise answers based on the patient data available."
+
+# Cache breakpoint on the system prompt; the cached prefix also covers the
+# tool definitions, which precede the system prompt in every request
+SYSTEM = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+# Tools that only read patient data; any other tool invalidates cached responses
+READ_ONLY_TOOLS = {"query_patients"}
+
+# Follow-up rounds of tool calls allowed per message before giving up
+MAX_TOOL_ROUNDS = 5
+TOOL_ROUNDS_ERROR = f"Stopped after {MAX_TOOL_ROUNDS} rounds of tool calls without a final answer."
+
+# Chat responses for repeated questions. Writes through this process clear the
+# cache, but other workers and the CLI write through their own MCP servers, so
+# entries also expire after a short time
+RESPONSE_CACHE_TTL = 60.0
+response_cache = ResponseCache(ttl=RESPONSE_CACHE_TTL)
 
 # MCP server parameters
 server_params = StdioServerParameters(
@@ -25,155 +61,371 @@ server_params = StdioServerParameters(
     env=None
 )
 
+# Shared MCP session, connected on first use and kept until the server goes away
+_exit_stack = None
+_session = None
+_session_lock = None
+_tools = None
+
+async def get_session():
+    """Return the shared MCP client session, connecting on first use."""
+    global _exit_stack, _session, _session_lock, _tools
+    if _session is not None:
+        return _session
+    
+    if _session_lock is None:
+        _session_lock = asyncio.Lock()
+    
+    async with _session_lock:
+        if _session is None:
+            exit_stack = AsyncExitStack()
+            try:
+                read_stream, write_stream = await exit_stack.enter_async_context(stdio_client(server_params))
+                session = await exit_stack.enter_async_context(ClientSession(read_stream, write_stream))
+                await session.initialize()
+                
+                # The tool list is static for the server's lifetime, so build it once
+                tools_result = await session.list_tools()
+            except Exception:
+                await close_exit_stack(exit_stack)
+                raise
+            _tools = [
+                {"name": tool.name, "description": tool.description, "input_schema": tool.inputSchema}
+                for tool in tools_result.tools
+            ]
+            _exit_stack, _session = exit_stack, session
+    
+    return _session
+
+async def close_exit_stack(exit_stack):
+    """Shut down a session's server process, ignoring errors from one already gone."""
+    try:
+        await exit_stack.aclose()
+    except Exception:
+        pass
+
+async def reset_session(session):
+    """Drop a broken shared session so the next get_session() reconnects."""
+    global _exit_stack, _session, _tools
+    if _session is not session:
+        return  # Already replaced by another caller
+    exit_stack = _exit_stack
+    _exit_stack = _session = _tools = None
+    await close_exit_stack(exit_stack)
+
+# Raised when sending to a server process that has exited, so the request
+# never reached it and is safe to send again after reconnecting
+TRANSPORT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+async def call_session(method, *args, **kwargs):
+    """Call a method on the shared MCP session, reconnecting once if the server has gone away."""
+    session = await get_session()
+    try:
+        return await getattr(session, method)(*args, **kwargs)
+    except TRANSPORT_ERRORS:
+        await reset_session(session)
+        session = await get_session()
+        return await getattr(session, method)(*args, **kwargs)
+
+async def read_resource_text(uri):
+    """Read an MCP resource and return its text content."""
+    result = await call_session("read_resource", uri)
+    return result.contents[0].text
+
 async def get_all_patients():
     """Get all patients using MCP."""
-    async with stdio_client(server_params) as (read_stream, write_stream):
-        async with ClientSession(read_stream, write_stream) as session:
-            await session.initialize()
-            
-            # Get resource content as string
-            content, _ = await session.read_resource("patients://all")
-            
-            # Process the content based on your specific implementation
-            # This is just an example - adjust based on your actual data format
-            patients = []
-            for line in content.strip().split('\n')[1:]:  # Skip header
-                if not line:
-                    continue
-                parts = line.split('|')
-                if len(parts) >= 4:
-                    patients.append({
-                        'id': parts[0].strip(),
-                        'name': parts[1].strip(),
-                        'species': parts[2].strip(),
-                        'breed': parts[3].strip(),
-                    })
-            
-            return patients
+    return orjson.loads(await read_patients_json())
 
 async def get_patient_details(patient_id):
-    """Get details for a specific patient."""
-    async with stdio_client(server_params) as (read_stream, write_stream):
-        async with ClientSession(read_stream, write_stream) as session:
-            await session.initialize()
-            
-            # Get resource content
-            content, _ = await session.read_resource(f"patients://{patient_id}")
-            
-            # Parse the content based on your specific implementation
-            lines = content.strip().split('\n')
-            patient = {'id': patient_id}
-            
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    patient[key.strip().lower().replace(' ', '_')] = value.strip()
-            
-            return patient
+    """Get details for a specific patient, or None if not found."""
+    return orjson.loads(await read_patient_details_json(patient_id))
+
+async def read_patients_json():
+    """Get all patients as the JSON text served by the MCP server."""
+    return await read_resource_text("data://patients")
+
+async def read_patient_details_json(patient_id):
+    """Get a patient's details as JSON text, "null" if not found."""
+    return await read_resource_text(f"data://patients/{patient_id}")
+
+# Patient IDs are free-form, but batch custom_ids must match ^[a-zA-Z0-9_-]{1,64}$.
+# IDs that already match are used as they are; any other ID is base32-encoded
+# behind a "--" prefix, so every worker can map results back to patient IDs
+CUSTOM_ID_RE = re.compile(r"[a-zA-Z0-9_-]{1,64}")
+ENCODED_ID_PREFIX = "--"
+
+def encode_custom_id(patient_id):
+    """Return the batch custom_id for a patient ID, or None if it can't fit."""
+    if CUSTOM_ID_RE.fullmatch(patient_id) and not patient_id.startswith(ENCODED_ID_PREFIX):
+        return patient_id
+    encoded = ENCODED_ID_PREFIX + base64.b32encode(patient_id.encode()).decode().rstrip("=").lower()
+    return encoded if CUSTOM_ID_RE.fullmatch(encoded) else None
+
+def decode_custom_id(custom_id):
+    """Return the patient ID a batch custom_id was made from."""
+    if not custom_id.startswith(ENCODED_ID_PREFIX):
+        return custom_id
+    encoded = custom_id[len(ENCODED_ID_PREFIX):].upper()
+    return base64.b32decode(encoded + "=" * (-len(encoded) % 8)).decode()
+
+async def create_patient_reports():
+    """
+    Submit a summary request for every patient as one Message Batch.
+    
+    Batches are processed asynchronously at reduced cost; poll the returned
+    batch ID with get_patient_reports. Patients whose IDs are too long to
+    encode as a custom_id are listed as skipped.
+    """
+    patients = await get_all_patients()
+    details = await asyncio.gather(*[get_patient_details(patient["id"]) for patient in patients])
+    prompts = await asyncio.gather(*[
+        call_session("get_prompt", "patient_summary_prompt", {"patient_id": patient["id"]})
+        for patient in patients
+    ])
+    
+    requests = []
+    skipped = []
+    for summary, patient, prompt in zip(patients, details, prompts):
+        custom_id = encode_custom_id(summary["id"])
+        if custom_id is None:
+            skipped.append(summary["id"])
+            continue
+        requests.append({
+            "custom_id": custom_id,
+            "params": {
+                "model": MODEL,
+                "system": SYSTEM,
+                "messages": [{
+                    "role": "user",
+                    "content": f"{prompt.messages[0].content.text}\nPatient record:\n{orjson.dumps(patient).decode()}"
+                }],
+                "max_tokens": 1000
+            }
+        })
+    
+    batch = await claude.messages.batches.create(requests=requests)
+    return {"id": batch.id, "status": batch.processing_status, "skipped": skipped}
+
+async def get_patient_reports(batch_id):
+    """Get the status of a report batch, with the reports once it has ended."""
+    batch = await claude.messages.batches.retrieve(batch_id)
+    if batch.processing_status != "ended":
+        return {"id": batch.id, "status": batch.processing_status}
+    
+    reports = {}
+    async for entry in await claude.messages.batches.results(batch_id):
+        key = decode_custom_id(entry.custom_id)
+        if entry.result.type == "succeeded":
+            reports[key] = "".join(
+                content.text for content in entry.result.message.content if content.type == "text"
+            )
+        else:
+            reports[key] = None
+    
+    return {"id": batch.id, "status": batch.processing_status, "reports": reports}
 
 async def create_patient(data):
     """Create a new patient."""
-    async with stdio_client(server_params) as (read_stream, write_stream):
-        async with ClientSession(read_stream, write_stream) as session:
-            await session.initialize()
-            
-            # Call the create_patient tool
-            result = await session.call_tool(
-                name="create_patient",
-                arguments=data
-            )
-            
-            # Extract text content from the result
-            response_text = ""
-            for item in result.content:
-                if hasattr(item, 'text'):
-                    response_text = item.text
-            
-            return response_text
+    # Call the create_patient tool
+    result = await call_session(
+        "call_tool",
+        name="create_patient",
+        arguments=data
+    )
+    
+    response_cache.clear()
+    
+    # Extract text content from the result
+    return next((item.text for item in result.content if item.type == "text"), "")
+
+async def get_tools():
+    """Return the MCP server's tools in the format expected by Claude."""
+    await get_session()
+    return _tools
+
+async def run_tools(tool_uses):
+    """
+    Execute Claude's tool_use blocks concurrently.
+    
+    Returns the tool/error entries for the chat response and the matching
+    tool_result blocks to send back to Claude.
+    """
+    tool_outputs = await asyncio.gather(
+        *[call_session("call_tool", content.name, content.input) for content in tool_uses],
+        return_exceptions=True
+    )
+    
+    if any(content.name not in READ_ONLY_TOOLS for content in tool_uses):
+        response_cache.clear()
+    
+    results = []
+    tool_results = []
+    for content, result in zip(tool_uses, tool_outputs):
+        if isinstance(result, Exception):
+            error_message = f"Error executing tool: {str(result)}"
+            results.append({
+                "type": "error",
+                "content": error_message
+            })
+            tool_results.append({"type": "tool_result", "tool_use_id": content.id, "content": error_message, "is_error": True})
+            continue
+        
+        # Extract the text result
+        tool_result = next((item.text for item in result.content if item.type == "text"), "Tool execution failed.")
+        
+        # Add tool results
+        results.append({
+            "type": "tool",
+            "name": content.name,
+            "args": content.input,
+            "result": tool_result
+        })
+        tool_results.append({"type": "tool_result", "tool_use_id": content.id, "content": tool_result})
+    
+    return results, tool_results
 
 async def process_message(message):
     """Process a chat message with Claude using MCP tools."""
-    async with stdio_client(server_params) as (read_stream, write_stream):
-        async with ClientSession(read_stream, write_stream) as session:
-            await session.initialize()
-            
-            # Get available tools
-            tools_result = await session.list_tools()
-            tools = []
-            for tool in tools_result.tools:
-                tools.append({
-                    "name": tool.name,
-                    "description": tool.description,
-                    "input_schema": tool.inputSchema
-                })
-            
-            # System prompt
-            system_prompt = "You are a veterinary assistant AI helping with a Veterinary Practice Management System. Provide concise answers based on the patient data available."
-            
-            # Send to Claude
-            response = claude.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                system=system_prompt,
-                messages=[{"role": "user", "content": message}],
+    cache_key = normalize_query(message)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    tools = await get_tools()
+    
+    messages = [{"role": "user", "content": message}]
+    
+    # Send to Claude
+    response = await claude.messages.create(
+        model=MODEL,
+        system=SYSTEM,
+        messages=messages,
+        tools=tools,
+        max_tokens=1000
+    )
+    
+    results = []
+    tool_uses = []
+    
+    # Process Claude's response
+    for content in response.content:
+        if content.type == "text":
+            results.append({
+                "type": "text",
+                "content": content.text
+            })
+        
+        elif content.type == "tool_use":
+            tool_uses.append(content)
+    
+    if not tool_uses:
+        response_cache.put(cache_key, results)
+        return results
+    
+    # Run the requested tools until Claude answers without asking for more
+    used_tools = []
+    rounds = 0
+    while tool_uses:
+        if rounds == MAX_TOOL_ROUNDS:
+            results.append({"type": "error", "content": TOOL_ROUNDS_ERROR})
+            return results
+        rounds += 1
+        used_tools.extend(tool_uses)
+        
+        # Execute all requested tools concurrently
+        tool_entries, tool_results = await run_tools(tool_uses)
+        results.extend(tool_entries)
+        messages = messages + [
+            {"role": "assistant", "content": response.content},
+            {"role": "user", "content": tool_results}
+        ]
+        
+        # Get Claude's response to all tool results in a single call, joining
+        # the streamed text deltas as they arrive
+        try:
+            async with claude.messages.stream(
+                model=MODEL,
+                system=SYSTEM,
+                messages=messages,
                 tools=tools,
                 max_tokens=1000
-            )
-            
-            results = []
-            
-            # Process Claude's response
-            for content in response.content:
-                if content.type == "text":
-                    results.append({
-                        "type": "text",
-                        "content": content.text
-                    })
-                
-                elif content.type == "tool_use":
-                    tool_name = content.name
-                    tool_args = content.input
-                    
-                    # Execute the tool
-                    try:
-                        result = await session.call_tool(tool_name, tool_args)
-                        tool_result = "Tool execution failed."
-                        
-                        # Extract the text result
-                        for item in result.content:
-                            if hasattr(item, 'text'):
-                                tool_result = item.text
-                        
-                        # Add tool results
-                        results.append({
-                            "type": "tool",
-                            "name": tool_name,
-                            "args": tool_args,
-                            "result": tool_result
-                        })
-                        
-                        # Get Claude's response to the tool result
-                        tool_response = claude.messages.create(
-                            model="claude-3-5-sonnet-20240620",
-                            system=system_prompt,
-                            messages=[
-                                {"role": "user", "content": message},
-                                {"role": "assistant", "content": [{"type": "tool_use", "id": content.id, "name": tool_name, "input": tool_args}]},
-                                {"role": "user", "content": [{"type": "tool_result", "tool_use_id": content.id, "content": tool_result}]}
-                            ],
-                            max_tokens=1000
-                        )
-                        
-                        # Add Claude's final response
-                        if tool_response.content[0].type == "text":
-                            results.append({
-                                "type": "text",
-                                "content": tool_response.content[0].text
-                            })
-                    
-                    except Exception as e:
-                        results.append({
-                            "type": "error",
-                            "content": f"Error executing tool: {str(e)}"
-                        })
-            
+            ) as stream:
+                final_text = "".join([text async for text in stream.text_stream])
+                response = await stream.get_final_message()
+        except Exception as e:
+            results.append({
+                "type": "error",
+                "content": f"Error getting response to tool results: {str(e)}"
+            })
             return results
+        
+        # Add Claude's response
+        if final_text:
+            results.append({
+                "type": "text",
+                "content": final_text
+            })
+        
+        tool_uses = [content for content in response.content if content.type == "tool_use"]
+    
+    # Only cache answers built purely from reads, so a write from this process
+    # is never replayed, and never cache failures
+    if all(content.name in READ_ONLY_TOOLS for content in used_tools) and \
+            not any(entry["type"] == "error" for entry in results):
+        response_cache.put(cache_key, results)
+    
+    return results
+
+async def stream_message(message):
+    """
+    Stream a chat reply from Claude using MCP tools.
+    
+    Yields "token" events with text deltas as they arrive, plus the same
+    "tool" and "error" entries returned by process_message.
+    """
+    tools = await get_tools()
+    
+    messages = [{"role": "user", "content": message}]
+    
+    async with claude.messages.stream(
+        model=MODEL,
+        system=SYSTEM,
+        messages=messages,
+        tools=tools,
+        max_tokens=1000
+    ) as stream:
+        async for text in stream.text_stream:
+            yield {"type": "token", "content": text}
+        response = await stream.get_final_message()
+    
+    # Run the requested tools until Claude answers without asking for more
+    tool_uses = [content for content in response.content if content.type == "tool_use"]
+    rounds = 0
+    while tool_uses:
+        if rounds == MAX_TOOL_ROUNDS:
+            yield {"type": "error", "content": TOOL_ROUNDS_ERROR}
+            return
+        rounds += 1
+        
+        # Execute all requested tools concurrently
+        tool_entries, tool_results = await run_tools(tool_uses)
+        for entry in tool_entries:
+            yield entry
+        messages = messages + [
+            {"role": "assistant", "content": response.content},
+            {"role": "user", "content": tool_results}
+        ]
+        
+        # Stream Claude's response to all tool results
+        async with claude.messages.stream(
+            model=MODEL,
+            system=SYSTEM,
+            messages=messages,
+            tools=tools,
+            max_tokens=1000
+        ) as stream:
+            async for text in stream.text_stream:
+                yield {"type": "token", "content": text}
+            response = await stream.get_final_message()
+        
+        tool_uses = [content for content in response.content if content.type == "tool_use"]
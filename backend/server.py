@@ -1,178 +1,435 @@
+import asyncio
+import functools
+import io
+import queue
+import re
 import sqlite3
-from contextlib import asynccontextmanager
+import threading
+from contextlib import asynccontextmanager, contextmanager
 from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
 
+import orjson
 from mcp.server.fastmcp import FastMCP, Context
 
 # Initialize the FastMCP server
 mcp = FastMCP("Vet Clinic")
 
-# Database connection function
-def get_db_connection():
-    """Create and return a connection to the SQLite database."""
-    conn = sqlite3.connect("vet_clinic.db")
+DB_PATH = "vet_clinic.db"
+
+# Pool of reusable connections, so tool calls running in parallel worker
+# threads each get their own; connections are opened on first demand
+POOL_SIZE = 4
+_pool = queue.SimpleQueue()
+_pool_opened = 0
+
+# PRAGMA data_version last seen on each pooled connection; it changes when any
+# other connection, including one in another process, commits
+_data_versions = {}
+_pool_lock = threading.Lock()
+
+def _open_connection():
+    """Open a new connection to the SQLite database."""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
+# Database connection function
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection to the SQLite database for the duration of a block."""
+    global _pool_opened
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        with _pool_lock:
+            can_open = _pool_opened < POOL_SIZE
+            if can_open:
+                _pool_opened += 1
+        if not can_open:
+            conn = _pool.get()
+        else:
+            try:
+                conn = _open_connection()
+            except Exception:
+                # Free the slot so a later borrow can try opening again
+                with _pool_lock:
+                    _pool_opened -= 1
+                raise
+    try:
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if _data_versions.get(conn) != data_version:
+            _data_versions[conn] = data_version
+            _invalidate_caches()
+        yield conn
+    finally:
+        _pool.put(conn)
+
+# Repeated lookups are common mid-conversation, so patient reads and searches
+# are memoized until the data changes: after a write from this server, or once
+# a borrowed connection sees a commit from another process. Reads run in worker
+# threads and can finish after the caches are cleared, so each entry is keyed
+# by the generation it started under; a stale read is cached under an old
+# generation that no later lookup asks for
+CACHE_SIZE = 512
+_cache_generation = 0
+
+def _current_generation():
+    """Return the cache generation, after checking for commits from other processes."""
+    with db_connection():
+        return _cache_generation
+
+def _invalidate_caches():
+    """Drop memoized patient reads after the data changes."""
+    global _cache_generation
+    _cache_generation += 1
+    _patient_details.cache_clear()
+    _patient_data.cache_clear()
+    _search_patients.cache_clear()
+
+# SQLite allows a single writer at a time, so write tools take turns
+_write_lock = asyncio.Lock()
+
+def in_thread(func):
+    """Run a blocking database tool or resource in a worker thread, off the MCP stdio event loop."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+def write_in_thread(func):
+    """Like in_thread, but only let one write tool run at a time."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with _write_lock:
+            return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+# Queries are shared as constants so each connection's statement cache keeps
+# them compiled; the *_DATA_SQL variants use the JSON field names
+SCHEMAS_SQL = """
+    SELECT name, sql
+    FROM sqlite_master
+    WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'patients_fts%'
+"""
+TABLE_SCHEMA_SQL = """
+    SELECT sql
+    FROM sqlite_master
+    WHERE type = 'table' AND name = ? AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'patients_fts%'
+"""
+TABLE_COLUMNS_SQL = "SELECT name, type FROM pragma_table_info(?)"
+# The listing queries format each result line in SQLite; missing values read
+# "None" as they did when the lines were formatted in Python
+PATIENT_LINES_SQL = """
+    SELECT printf('ID: %s | Name: %s | Species: %s | Breed: %s', id, name, species, ifnull(breed, 'None')) || char(10)
+    FROM patients
+    ORDER BY name
+"""
+PATIENTS_DATA_SQL = """
+    SELECT id, name, species, breed, gender, birth_date AS birthDate, microchip_number AS microchipNumber
+    FROM patients
+    ORDER BY name
+"""
+SEARCH_FTS_SQL = """
+    SELECT printf('ID: %s | Name: %s | Species: %s | Breed: %s | Gender: %s',
+                  p.id, p.name, p.species, ifnull(p.breed, 'None'), ifnull(p.gender, 'None')) || char(10)
+    FROM patients_fts f
+    JOIN patients p ON p.rowid = f.rowid
+    WHERE patients_fts MATCH ?
+    ORDER BY p.name
+"""
+SEARCH_LIKE_SQL = """
+    SELECT printf('ID: %s | Name: %s | Species: %s | Breed: %s | Gender: %s',
+                  id, name, species, ifnull(breed, 'None'), ifnull(gender, 'None')) || char(10)
+    FROM patients
+    WHERE name LIKE ? OR species LIKE ? OR breed LIKE ?
+    ORDER BY name
+"""
+PATIENT_SQL = """
+    SELECT id, name, species, breed, gender, birth_date, microchip_number
+    FROM patients
+    WHERE id = ?
+"""
+PATIENT_DATA_SQL = """
+    SELECT id, name, species, breed, gender, birth_date AS birthDate, microchip_number AS microchipNumber
+    FROM patients
+    WHERE id = ?
+"""
+APPOINTMENTS_SQL = """
+    SELECT date, status, notes, appointment_type
+    FROM appointments
+    WHERE patient_id = ?
+    ORDER BY date DESC
+"""
+APPOINTMENTS_DATA_SQL = """
+    SELECT date, status, notes, appointment_type AS appointmentType
+    FROM appointments
+    WHERE patient_id = ?
+    ORDER BY date DESC
+"""
+WEIGHTS_SQL = """
+    SELECT weight, date, note
+    FROM weight_records
+    WHERE patient_id = ?
+    ORDER BY date DESC
+"""
+VACCINATIONS_SQL = """
+    SELECT type, date, expiration_date
+    FROM vaccinations
+    WHERE patient_id = ?
+    ORDER BY date DESC
+"""
+VACCINATIONS_DATA_SQL = """
+    SELECT type, date, expiration_date AS expirationDate
+    FROM vaccinations
+    WHERE patient_id = ?
+    ORDER BY date DESC
+"""
+
+# Writes; the record inserts only add a row when the patient exists, and
+# return the patient's name for the confirmation message
+CREATE_PATIENT_SQL = """
+    INSERT INTO patients (id, name, species, breed, gender, birth_date, microchip_number)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO NOTHING
+"""
+ADD_APPOINTMENT_SQL = """
+    INSERT INTO appointments (patient_id, date, appointment_type, status, notes)
+    SELECT id, ?, ?, ?, ? FROM patients WHERE id = ?
+    RETURNING (SELECT name FROM patients WHERE id = patient_id) AS name
+"""
+ADD_WEIGHT_SQL = """
+    INSERT INTO weight_records (patient_id, weight, date, note)
+    SELECT id, ?, ?, ? FROM patients WHERE id = ?
+    RETURNING (SELECT name FROM patients WHERE id = patient_id) AS name
+"""
+ADD_VACCINATION_SQL = """
+    INSERT INTO vaccinations (patient_id, type, date, expiration_date)
+    SELECT id, ?, ?, ? FROM patients WHERE id = ?
+    RETURNING (SELECT name FROM patients WHERE id = patient_id) AS name
+"""
+# Fixed-shape update so every call reuses one compiled statement; a NULL
+# parameter keeps the column's current value
+UPDATE_PATIENT_SQL = """
+    UPDATE patients SET
+        name = COALESCE(?, name),
+        species = COALESCE(?, species),
+        breed = COALESCE(?, breed),
+        gender = COALESCE(?, gender),
+        birth_date = COALESCE(?, birth_date),
+        microchip_number = COALESCE(?, microchip_number)
+    WHERE id = ?
+"""
+
+def _read_patient(conn, patient_sql, record_sqls, patient_id):
+    """
+    Fetch a patient row and its record lists in one read transaction.
+    
+    Args:
+        conn: Database connection
+        patient_sql: Query for the patient row
+        record_sqls: Queries for each list of related records
+        patient_id: ID of the patient
+        
+    Returns:
+        (patient, [records, ...]) from a consistent snapshot, or None if not found
+    """
+    with conn:
+        conn.execute("BEGIN")
+        patient = conn.execute(patient_sql, (patient_id,)).fetchone()
+        if not patient:
+            return None
+        return patient, [conn.execute(sql, (patient_id,)).fetchall() for sql in record_sqls]
+
+# Dates are stored as text and sorted as strings, so they must be zero-padded;
+# the pattern check is cheap and rejects most bad input before parsing
+DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+DATETIME_RE = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}")
+
+# Appointment statuses the clinic tracks
+APPOINTMENT_STATUSES = frozenset({"Scheduled", "Completed", "Cancelled", "No Show"})
+
+def _is_valid_date(value: str, pattern=DATE_RE) -> bool:
+    """Check that a value matches the date pattern and is a real calendar date."""
+    if not pattern.fullmatch(value):
+        return False
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
 # ====== RESOURCES ======
 
 @mcp.resource("schema://all")
+@in_thread
 def get_all_schemas() -> str:
     """Retrieve schema information for all tables in the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get schema for all tables
-    schema_query = """
-    SELECT 
-        name, 
-        sql
-    FROM 
-        sqlite_master
-    WHERE 
-        type='table' AND 
-        name NOT LIKE 'sqlite_%'
-    """
-    
-    tables = cursor.execute(schema_query).fetchall()
-    schema_info = []
-    
-    for table in tables:
-        schema_info.append(f"Table: {table['name']}\n{table['sql']}\n")
-    
-    conn.close()
-    return "\n".join(schema_info)
+    return _all_schemas(_schema_version())
+
+# Schema reads are memoized by PRAGMA schema_version, which SQLite bumps on
+# every schema change, so a migration by init.py while the server runs (or a
+# table created after a lookup missed) is picked up on the next read
+def _schema_version():
+    """Return the database's current schema version."""
+    with db_connection() as conn:
+        return conn.execute("PRAGMA schema_version").fetchone()[0]
+
+@functools.lru_cache(maxsize=1)
+def _all_schemas(schema_version: int) -> str:
+    """Build the schema text for get_all_schemas."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Write each table's schema straight into one buffer, blank-line separated
+        schema_info = io.StringIO()
+        for table in cursor.execute(SCHEMAS_SQL):
+            if schema_info.tell():
+                schema_info.write("\n")
+            schema_info.write("Table: ")
+            schema_info.write(table['name'])
+            schema_info.write("\n")
+            schema_info.write(table['sql'])
+            schema_info.write("\n")
+        
+        return schema_info.getvalue()
 
 @mcp.resource("schema://{table_name}")
+@in_thread
 def get_table_schema(table_name: str) -> str:
     """Retrieve schema information for a specific table."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Verify the table exists
-    table_check = cursor.execute(
-        "SELECT name FROM sqlite_master WHERE type='table' AND name=?", 
-        (table_name,)
-    ).fetchone()
-    
-    if not table_check:
-        conn.close()
-        return f"Table '{table_name}' not found."
-    
-    # Get table schema
-    schema = cursor.execute(
-        "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", 
-        (table_name,)
-    ).fetchone()
-    
-    # Get column info
-    columns = cursor.execute(f"PRAGMA table_info({table_name})").fetchall()
-    column_info = "\nColumns:\n" + "\n".join(
-        [f"- {col['name']} ({col['type']})" for col in columns]
-    )
-    
-    conn.close()
-    return f"Table: {table_name}\n{schema['sql']}{column_info}"
+    return _table_schema(_schema_version(), table_name)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _table_schema(schema_version: int, table_name: str) -> str:
+    """Build the schema text for get_table_schema."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Get table schema, which also verifies the table exists
+        schema = cursor.execute(TABLE_SCHEMA_SQL, (table_name,)).fetchone()
+        
+        if not schema:
+            return f"Table '{table_name}' not found."
+        
+        # Get column info
+        columns = cursor.execute(TABLE_COLUMNS_SQL, (table_name,)).fetchall()
+        column_info = "\nColumns:\n" + "\n".join(
+            [f"- {col['name']} ({col['type']})" for col in columns]
+        )
+        
+        return f"Table: {table_name}\n{schema['sql']}{column_info}"
 
 @mcp.resource("patients://all")
+@in_thread
 def get_all_patients() -> str:
     """List all patients in the system."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    patients = cursor.execute("""
-        SELECT id, name, species, breed, gender, birth_date, microchip_number
-        FROM patients
-        ORDER BY name
-    """).fetchall()
-    
-    if not patients:
-        conn.close()
-        return "No patients found."
-    
-    result = "Patients:\n"
-    for patient in patients:
-        result += f"ID: {patient['id']} | Name: {patient['name']} | Species: {patient['species']} | Breed: {patient['breed']}\n"
-    
-    conn.close()
-    return result
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Collect the lines SQLite formats as the cursor steps through them
+        parts = ["Patients:\n"]
+        parts.extend(line for (line,) in cursor.execute(PATIENT_LINES_SQL))
+        
+        if len(parts) == 1:
+            return "No patients found."
+        
+        return "".join(parts)
 
 @mcp.resource("patients://{patient_id}")
+@in_thread
 def get_patient_details(patient_id: str) -> str:
     """Get detailed information about a specific patient."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get patient info
-    patient = cursor.execute("""
-        SELECT id, name, species, breed, gender, birth_date, microchip_number
-        FROM patients
-        WHERE id = ?
-    """, (patient_id,)).fetchone()
-    
-    if not patient:
-        conn.close()
+    return _patient_details(_current_generation(), patient_id)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _patient_details(generation: int, patient_id: str) -> str:
+    """Build the patient details text for get_patient_details."""
+    with db_connection() as conn:
+        records = _read_patient(
+            conn, PATIENT_SQL, (APPOINTMENTS_SQL, WEIGHTS_SQL, VACCINATIONS_SQL), patient_id
+        )
+    
+    if not records:
         return f"Patient with ID {patient_id} not found."
+    patient, (appointments, weights, vaccinations) = records
     
     # Format patient info
-    result = f"Patient: {patient['name']} (ID: {patient['id']})\n"
-    result += f"Species: {patient['species']}\n"
-    result += f"Breed: {patient['breed']}\n"
-    result += f"Gender: {patient['gender']}\n"
-    result += f"Birth Date: {patient['birth_date']}\n"
-    result += f"Microchip: {patient['microchip_number']}\n\n"
-    
-    # Get appointments
-    appointments = cursor.execute("""
-        SELECT date, status, notes, appointment_type
-        FROM appointments
-        WHERE patient_id = ?
-        ORDER BY date DESC
-    """, (patient_id,)).fetchall()
+    parts = [
+        f"Patient: {patient['name']} (ID: {patient['id']})\n"
+        f"Species: {patient['species']}\n"
+        f"Breed: {patient['breed']}\n"
+        f"Gender: {patient['gender']}\n"
+        f"Birth Date: {patient['birth_date']}\n"
+        f"Microchip: {patient['microchip_number']}\n\n"
+    ]
     
     if appointments:
-        result += "Appointments:\n"
+        parts.append("Appointments:\n")
         for appt in appointments:
-            result += f"- {appt['date']} | {appt['appointment_type']} | {appt['status']}\n"
+            parts.append(f"- {appt['date']} | {appt['appointment_type']} | {appt['status']}\n")
             if appt['notes']:
-                result += f"  Notes: {appt['notes']}\n"
-    
-    # Get weight history
-    weights = cursor.execute("""
-        SELECT weight, date, note
-        FROM weight_records
-        WHERE patient_id = ?
-        ORDER BY date DESC
-    """, (patient_id,)).fetchall()
+                parts.append(f"  Notes: {appt['notes']}\n")
     
     if weights:
-        result += "\nWeight History:\n"
+        parts.append("\nWeight History:\n")
         for weight in weights:
-            result += f"- {weight['date']} | {weight['weight']} kg"
             if weight['note']:
-                result += f" | {weight['note']}"
-            result += "\n"
-    
-    # Get vaccinations
-    vaccinations = cursor.execute("""
-        SELECT type, date, expiration_date
-        FROM vaccinations
-        WHERE patient_id = ?
-        ORDER BY date DESC
-    """, (patient_id,)).fetchall()
+                parts.append(f"- {weight['date']} | {weight['weight']} kg | {weight['note']}\n")
+            else:
+                parts.append(f"- {weight['date']} | {weight['weight']} kg\n")
     
     if vaccinations:
-        result += "\nVaccinations:\n"
+        parts.append("\nVaccinations:\n")
         for vax in vaccinations:
-            result += f"- {vax['type']} | Given: {vax['date']} | Expires: {vax['expiration_date']}\n"
+            parts.append(f"- {vax['type']} | Given: {vax['date']} | Expires: {vax['expiration_date']}\n")
     
-    conn.close()
-    return result
+    return "".join(parts)
+
+@mcp.resource("data://patients", mime_type="application/json")
+@in_thread
+def get_all_patients_data() -> str:
+    """List all patients as JSON."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        return orjson.dumps([dict(patient) for patient in cursor.execute(PATIENTS_DATA_SQL)]).decode()
+
+@mcp.resource("data://patients/{patient_id}", mime_type="application/json")
+@in_thread
+def get_patient_data(patient_id: str) -> str:
+    """Get detailed information about a specific patient as JSON, or null if not found."""
+    return _patient_data(_current_generation(), patient_id)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _patient_data(generation: int, patient_id: str) -> str:
+    """Build the patient details JSON for get_patient_data."""
+    with db_connection() as conn:
+        records = _read_patient(
+            conn, PATIENT_DATA_SQL, (APPOINTMENTS_DATA_SQL, WEIGHTS_SQL, VACCINATIONS_DATA_SQL), patient_id
+        )
+    
+    if not records:
+        return "null"
+    patient, (appointments, weights, vaccinations) = records
+    
+    result = dict(patient)
+    result["appointments"] = [dict(appt) for appt in appointments]
+    result["weightHistory"] = [dict(weight) for weight in weights]
+    result["vaccinations"] = [dict(vax) for vax in vaccinations]
+    
+    return orjson.dumps(result).decode()
 
 # ====== TOOLS ======
 
 @mcp.tool()
+@in_thread
 def query_patients(search_term: str) -> str:
     """
     Search for patients by name, species, or breed.
@@ -180,29 +437,41 @@ def query_patients(search_term: str) -> str:
     Args:
         search_term: Term to search for in patient records
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Search in multiple fields
-    patients = cursor.execute("""
-        SELECT id, name, species, breed, gender 
-        FROM patients
-        WHERE name LIKE ? OR species LIKE ? OR breed LIKE ?
-        ORDER BY name
-    """, (f"%{search_term}%", f"%{search_term}%", f"%{search_term}%")).fetchall()
+    # LIKE is case-insensitive, so normalizing only merges equivalent searches
+    matches = _search_patients(_current_generation(), search_term.strip().lower())
     
-    if not patients:
-        conn.close()
+    if not matches:
         return f"No patients found matching '{search_term}'."
     
-    result = f"Patients matching '{search_term}':\n"
-    for patient in patients:
-        result += f"ID: {patient['id']} | Name: {patient['name']} | Species: {patient['species']} | Breed: {patient['breed']} | Gender: {patient['gender']}\n"
-    
-    conn.close()
-    return result
+    return f"Patients matching '{search_term}':\n" + "".join(matches)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _search_patients(generation: int, term: str) -> tuple:
+    """Return the formatted result lines for a normalized search term."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        patients = None
+        
+        # Search the trigram full-text index, which needs at least three characters
+        if len(term) >= 3:
+            try:
+                patients = cursor.execute(
+                    SEARCH_FTS_SQL, ('"' + term.replace('"', '""') + '"',)
+                )
+            except sqlite3.OperationalError:
+                pass  # No full-text index in this database
+        
+        # Otherwise search in multiple fields
+        if patients is None:
+            patients = cursor.execute(
+                SEARCH_LIKE_SQL, (f"%{term}%", f"%{term}%", f"%{term}%")
+            )
+        
+        return tuple(line for (line,) in patients)
 
 @mcp.tool()
+@write_in_thread
 def create_patient(
     id: str, 
     name: str, 
@@ -224,38 +493,29 @@ def create_patient(
         birth_date: Birth date in YYYY-MM-DD format
         microchip_number: Microchip ID if available
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if patient ID already exists
-    existing = cursor.execute("SELECT id FROM patients WHERE id = ?", (id,)).fetchone()
-    if existing:
-        conn.close()
-        return f"Error: Patient with ID {id} already exists."
-    
     # Validate birth date format if provided
-    if birth_date:
-        try:
-            datetime.strptime(birth_date, '%Y-%m-%d')
-        except ValueError:
-            conn.close()
-            return "Error: Birth date must be in YYYY-MM-DD format."
+    if birth_date and not _is_valid_date(birth_date):
+        return "Error: Birth date must be in YYYY-MM-DD format."
     
-    # Insert new patient
-    try:
-        cursor.execute("""
-            INSERT INTO patients (id, name, species, breed, gender, birth_date, microchip_number)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (id, name, species, breed, gender, birth_date, microchip_number))
+    with db_connection() as conn:
+        cursor = conn.cursor()
         
-        conn.commit()
-        conn.close()
-        return f"Patient {name} (ID: {id}) created successfully."
-    except sqlite3.Error as e:
-        conn.close()
-        return f"Error creating patient: {str(e)}"
+        # Insert new patient; an existing ID inserts nothing
+        try:
+            with conn:
+                cursor.execute(
+                    CREATE_PATIENT_SQL,
+                    (id, name, species, breed, gender, birth_date, microchip_number)
+                )
+            if cursor.rowcount == 0:
+                return f"Error: Patient with ID {id} already exists."
+            _invalidate_caches()
+            return f"Patient {name} (ID: {id}) created successfully."
+        except sqlite3.Error as e:
+            return f"Error creating patient: {str(e)}"
 
 @mcp.tool()
+@write_in_thread
 def update_patient(
     id: str,
     name: Optional[str] = None,
@@ -277,69 +537,34 @@ def update_patient(
         birth_date: New birth date in YYYY-MM-DD format (optional)
         microchip_number: New microchip number (optional)
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if patient exists
-    patient = cursor.execute("SELECT * FROM patients WHERE id = ?", (id,)).fetchone()
-    if not patient:
-        conn.close()
-        return f"Error: Patient with ID {id} not found."
-    
-    # Validate birth date format if provided
-    if birth_date:
-        try:
-            datetime.strptime(birth_date, '%Y-%m-%d')
-        except ValueError:
-            conn.close()
-            return "Error: Birth date must be in YYYY-MM-DD format."
-    
-    # Build update query dynamically based on provided fields
-    update_fields = []
-    params = []
-    
-    if name:
-        update_fields.append("name = ?")
-        params.append(name)
-    
-    if species:
-        update_fields.append("species = ?")
-        params.append(species)
-    
-    if breed is not None:  # Allow empty string to clear the field
-        update_fields.append("breed = ?")
-        params.append(breed)
-    
-    if gender is not None:
-        update_fields.append("gender = ?")
-        params.append(gender)
-    
-    if birth_date is not None:
-        update_fields.append("birth_date = ?")
-        params.append(birth_date)
-    
-    if microchip_number is not None:
-        update_fields.append("microchip_number = ?")
-        params.append(microchip_number)
-    
-    if not update_fields:
-        conn.close()
+    # Name and species are required, so empty values leave them unchanged;
+    # an empty string still clears the optional fields
+    params = (
+        name or None, species or None, breed, gender, birth_date, microchip_number
+    )
+    if all(value is None for value in params):
         return "No fields provided for update."
     
-    # Execute update
-    query = f"UPDATE patients SET {', '.join(update_fields)} WHERE id = ?"
-    params.append(id)
+    # Validate birth date format if provided
+    if birth_date and not _is_valid_date(birth_date):
+        return "Error: Birth date must be in YYYY-MM-DD format."
     
-    try:
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
-        return f"Patient {id} updated successfully."
-    except sqlite3.Error as e:
-        conn.close()
-        return f"Error updating patient: {str(e)}"
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Update the patient; a missing ID updates no rows
+        try:
+            with conn:
+                cursor.execute(UPDATE_PATIENT_SQL, (*params, id))
+            if cursor.rowcount == 0:
+                return f"Error: Patient with ID {id} not found."
+            _invalidate_caches()
+            return f"Patient {id} updated successfully."
+        except sqlite3.Error as e:
+            return f"Error updating patient: {str(e)}"
 
 @mcp.tool()
+@write_in_thread
 def add_appointment(
     patient_id: str,
     date: str,
@@ -354,40 +579,35 @@ def add_appointment(
         patient_id: ID of the patient
         date: Appointment date/time (YYYY-MM-DD HH:MM format)
         appointment_type: Type of appointment (Checkup, Vaccination, etc.)
-        status: Status of appointment (Scheduled, Completed, Cancelled, etc.)
+        status: Status of appointment (Scheduled, Completed, Cancelled, or No Show)
         notes: Additional notes about the appointment
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if patient exists
-    patient = cursor.execute("SELECT id, name FROM patients WHERE id = ?", (patient_id,)).fetchone()
-    if not patient:
-        conn.close()
-        return f"Error: Patient with ID {patient_id} not found."
-    
     # Validate date format
-    try:
-        datetime.strptime(date, '%Y-%m-%d %H:%M')
-    except ValueError:
-        conn.close()
+    if not _is_valid_date(date, DATETIME_RE):
         return "Error: Date must be in YYYY-MM-DD HH:MM format."
     
-    # Insert appointment
-    try:
-        cursor.execute("""
-            INSERT INTO appointments (patient_id, date, appointment_type, status, notes)
-            VALUES (?, ?, ?, ?, ?)
-        """, (patient_id, date, appointment_type, status, notes))
+    # Validate status
+    if status not in APPOINTMENT_STATUSES:
+        return f"Error: Status must be one of {', '.join(sorted(APPOINTMENT_STATUSES))}."
+    
+    with db_connection() as conn:
+        cursor = conn.cursor()
         
-        conn.commit()
-        conn.close()
-        return f"Appointment for {patient['name']} scheduled on {date} successfully."
-    except sqlite3.Error as e:
-        conn.close()
-        return f"Error scheduling appointment: {str(e)}"
+        # Insert appointment only if the patient exists, returning their name
+        try:
+            with conn:
+                patient = cursor.execute(
+                    ADD_APPOINTMENT_SQL, (date, appointment_type, status, notes, patient_id)
+                ).fetchone()
+            if patient is None:
+                return f"Error: Patient with ID {patient_id} not found."
+            _invalidate_caches()
+            return f"Appointment for {patient['name']} scheduled on {date} successfully."
+        except sqlite3.Error as e:
+            return f"Error scheduling appointment: {str(e)}"
 
 @mcp.tool()
+@write_in_thread
 def add_weight_record(
     patient_id: str,
     weight: float,
@@ -403,42 +623,32 @@ def add_weight_record(
         date: Date of measurement (YYYY-MM-DD format)
         note: Additional notes about the weight
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if patient exists
-    patient = cursor.execute("SELECT id, name FROM patients WHERE id = ?", (patient_id,)).fetchone()
-    if not patient:
-        conn.close()
-        return f"Error: Patient with ID {patient_id} not found."
-    
     # Validate date format
-    try:
-        datetime.strptime(date, '%Y-%m-%d')
-    except ValueError:
-        conn.close()
+    if not _is_valid_date(date):
         return "Error: Date must be in YYYY-MM-DD format."
     
     # Validate weight
     if weight <= 0:
-        conn.close()
         return "Error: Weight must be greater than zero."
     
-    # Insert weight record
-    try:
-        cursor.execute("""
-            INSERT INTO weight_records (patient_id, weight, date, note)
-            VALUES (?, ?, ?, ?)
-        """, (patient_id, weight, date, note))
+    with db_connection() as conn:
+        cursor = conn.cursor()
         
-        conn.commit()
-        conn.close()
-        return f"Weight record for {patient['name']} added successfully: {weight} kg on {date}."
-    except sqlite3.Error as e:
-        conn.close()
-        return f"Error adding weight record: {str(e)}"
+        # Insert weight record only if the patient exists, returning their name
+        try:
+            with conn:
+                patient = cursor.execute(
+                    ADD_WEIGHT_SQL, (weight, date, note, patient_id)
+                ).fetchone()
+            if patient is None:
+                return f"Error: Patient with ID {patient_id} not found."
+            _invalidate_caches()
+            return f"Weight record for {patient['name']} added successfully: {weight} kg on {date}."
+        except sqlite3.Error as e:
+            return f"Error adding weight record: {str(e)}"
 
 @mcp.tool()
+@write_in_thread
 def add_vaccination(
     patient_id: str,
     type: str,
@@ -454,36 +664,25 @@ def add_vaccination(
         date: Vaccination date (YYYY-MM-DD format)
         expiration_date: Expiration date (YYYY-MM-DD format)
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if patient exists
-    patient = cursor.execute("SELECT id, name FROM patients WHERE id = ?", (patient_id,)).fetchone()
-    if not patient:
-        conn.close()
-        return f"Error: Patient with ID {patient_id} not found."
-    
     # Validate date formats
-    try:
-        datetime.strptime(date, '%Y-%m-%d')
-        datetime.strptime(expiration_date, '%Y-%m-%d')
-    except ValueError:
-        conn.close()
+    if not all(_is_valid_date(value) for value in (date, expiration_date)):
         return "Error: Dates must be in YYYY-MM-DD format."
     
-    # Insert vaccination record
-    try:
-        cursor.execute("""
-            INSERT INTO vaccinations (patient_id, type, date, expiration_date)
-            VALUES (?, ?, ?, ?)
-        """, (patient_id, type, date, expiration_date))
+    with db_connection() as conn:
+        cursor = conn.cursor()
         
-        conn.commit()
-        conn.close()
-        return f"Vaccination record for {patient['name']} added successfully: {type} on {date}."
-    except sqlite3.Error as e:
-        conn.close()
-        return f"Error adding vaccination record: {str(e)}"
+        # Insert vaccination record only if the patient exists, returning their name
+        try:
+            with conn:
+                patient = cursor.execute(
+                    ADD_VACCINATION_SQL, (type, date, expiration_date, patient_id)
+                ).fetchone()
+            if patient is None:
+                return f"Error: Patient with ID {patient_id} not found."
+            _invalidate_caches()
+            return f"Vaccination record for {patient['name']} added successfully: {type} on {date}."
+        except sqlite3.Error as e:
+            return f"Error adding vaccination record: {str(e)}"
 
 # ====== PROMPTS ======
 
@@ -0,0 +1,3 @@
+# WSGI entry point for production servers, e.g.:
+#   gunicorn -w 2 -k gthread --threads 16 wsgi:app
+from app import app